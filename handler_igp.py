@@ -1,6 +1,10 @@
-import os, json, time, uuid
-from decimal import Decimal
-import boto3, requests
+import os, time, random
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor, wait
+from decimal import Decimal, Context, InvalidOperation
+import boto3, requests, orjson
+from boto3.dynamodb.types import TypeSerializer
+from botocore.config import Config
 
 DDB_TABLE = os.environ.get("DDB_TABLE", "TablaSismosIGP")
 ARCGIS_URL = ("https://ide.igp.gob.pe/arcgis/rest/services/monitoreocensis/"
@@ -9,64 +13,176 @@ FIELDS = ",".join([
     "objectid","fecha","hora","lat","lon","prof","ref","int_","profundidad",
     "sentido","magnitud","departamento","fechaevento","mag","code"
 ])
+# Parametros fijos de la consulta; requests acepta una secuencia de pares
+_PARAMS_BASE = (
+    ("where","1=1"),("outFields",FIELDS),
+    ("orderByFields","fechaevento desc"),("resultRecordCount",10),
+    ("returnGeometry","false"),("f","json")
+)
+# Atributos leidos de cada feature, en el orden en que se desempaquetan en _build
+_KEYS = ("code","mag","fecha","hora","fechaevento","lat","lon","prof","profundidad",
+         "ref","int_","sentido","magnitud","departamento")
+SOURCE = "IGP-ArcGIS"
+GSI_FECHA = "byFechaevento"  # PK=source, SK=fechaevento
 
-def _dec(x):
-    return Decimal(str(x)) if isinstance(x, float) else x
+# Keep-alive TCP y pool de conexiones para no repetir el handshake TLS en cada llamada.
+# Timeouts e intentos acotados para que una llamada tenga una duracion maxima conocida
+_DDB_CONNECT_S, _DDB_READ_S, _DDB_INTENTOS = 1, 2, 3
+_DDB_CONFIG = Config(tcp_keepalive=True, max_pool_connections=10,
+                     connect_timeout=_DDB_CONNECT_S, read_timeout=_DDB_READ_S,
+                     retries={"mode":"standard","max_attempts":_DDB_INTENTOS})
+# Peor caso de una llamada: todos los intentos agotan ambos timeouts, mas el backoff
+# de botocore entre ellos (hasta 2**n s en el intento n)
+_DDB_LLAMADA_MAX_S = _DDB_INTENTOS*(_DDB_CONNECT_S+_DDB_READ_S) + sum(2**n for n in range(_DDB_INTENTOS-1))
 
-def fetch_last_10():
-    params = {
-        "where":"1=1","outFields":FIELDS,
-        "orderByFields":"fechaevento desc","resultRecordCount":10,
-        "returnGeometry":"false","f":"json"
+# Reutilizado entre invocaciones (warm starts); si falla, el error se reporta en el handler
+try:
+    # Cliente de bajo nivel: resource.meta.client re-serializaria los AttributeValues
+    _CLIENT = boto3.client("dynamodb", config=_DDB_CONFIG)
+    _INIT_ERROR = None
+except Exception as e:
+    _CLIENT = None
+    _INIT_ERROR = e
+_SESSION = requests.Session()
+_SESSION.headers["Accept-Encoding"] = "gzip, deflate"  # requests descomprime la respuesta
+
+def _client():
+    if _INIT_ERROR is not None: raise _INIT_ERROR
+    return _CLIENT
+
+def _dumps(obj, default=None):
+    # orjson no serializa Decimal: default=str lo convierte como hacia json.dumps
+    return orjson.dumps(obj, default=default).decode()
+
+def _put(d, k, v):
+    if v is not None: d[k] = v
+
+_Q, _UNO = Decimal("0.0001"), Decimal(1)
+# 10 digitos sobran para lat/lon/magnitud. Contexto explicito en vez de tocar getcontext(),
+# que es por hilo y global al modulo decimal
+_CTX = Context(prec=10)
+
+def _put_num(d, k, v):
+    # orjson entrega float; from_float evita el paso por str (4 decimales bastan para lat/lon/magnitud).
+    # Strings numericos se parsean; lo que no es un numero finito se registra y se omite
+    if v is None: return
+    try:
+        if isinstance(v, bool): raise TypeError
+        n = Decimal.from_float(v) if isinstance(v, (int, float)) else _CTX.create_decimal(v.strip())
+        if not n.is_finite(): raise InvalidOperation
+        # Sin ceros de sobra ni exponente: mismo texto que devuelve DynamoDB en lambda_listar
+        n = n.quantize(_Q, context=_CTX).normalize(_CTX)
+        d[k] = n.quantize(_UNO, context=_CTX) if n.as_tuple().exponent > 0 else n
+    except (TypeError, AttributeError, InvalidOperation):
+        print(f"{k} descartado: {v!r}")
+
+def _build(f, now_ms):
+    a = (f or {}).get("attributes") or {}
+    code,mag,fecha,hora,fe,lat,lon,prof,pc,ref,i_,se,magn,dep = map(a.get, _KEYS)
+    if not code:
+        import uuid  # solo se carga si ArcGIS no envia code
+        code = uuid.uuid4()
+    # DynamoDB no acepta atributos None: se omiten al construir el item
+    it = {
+        "code": str(code),
+        "reporte": str(mag or ""),
+        "hora": str(hora or ""),
+        "profundidad_cat": str(pc or ""),
+        "referencia": str(ref or ""),
+        "intensidad": str(i_ or ""),
+        "sentido": str(se or ""),
+        "departamento": str(dep or ""),
+        "ingresado_ts": now_ms,
+        "source": SOURCE
     }
-    r = requests.get(ARCGIS_URL, params=params, timeout=15); r.raise_for_status()
-    feats = r.json().get("features", [])
-    items = []
-    for f in feats:
-        a = (f or {}).get("attributes", {}) or {}
-        code = str(a.get("code") or uuid.uuid4())
-        items.append({
-            "code": code,
-            "reporte": str(a.get("mag") or ""),
-            "fecha": a.get("fecha"),
-            "hora": str(a.get("hora") or ""),
-            "fechaevento": a.get("fechaevento"),
-            "lat": _dec(a.get("lat")) if a.get("lat") is not None else None,
-            "lon": _dec(a.get("lon")) if a.get("lon") is not None else None,
-            "prof_km": a.get("prof"),
-            "profundidad_cat": str(a.get("profundidad") or ""),
-            "referencia": str(a.get("ref") or ""),
-            "intensidad": str(a.get("int_") or ""),
-            "sentido": str(a.get("sentido") or ""),
-            "magnitud": _dec(a.get("magnitud")) if a.get("magnitud") is not None else None,
-            "departamento": str(a.get("departamento") or ""),
-            "ingresado_ts": int(time.time()*1000),
-            "source": "IGP-ArcGIS"
-        })
-    # DynamoDB no acepta atributos None
-    return [{k:v for k,v in it.items() if v is not None} for it in items]
-
-def upsert(items):
-    ddb = boto3.resource("dynamodb").Table(DDB_TABLE)
-    with ddb.batch_writer(overwrite_by_pkeys=["code"]) as b:
-        for it in items: b.put_item(Item=it)
+    _put(it, "fecha", fecha)
+    _put(it, "fechaevento", fe)
+    _put_num(it, "lat", lat)
+    _put_num(it, "lon", lon)
+    _put(it, "prof_km", prof)
+    _put_num(it, "magnitud", magn)
+    return it
+
+def fetch_last_10():
+    r = _SESSION.get(ARCGIS_URL, params=_PARAMS_BASE, timeout=15); r.raise_for_status()
+    feats = orjson.loads(r.content).get("features", [])
+    now_ms = int(time.time()*1000)  # todos los items vienen de la misma respuesta
+    return [_build(f, now_ms) for f in feats]
+
+# botocore ya reintenta throttling y 5xx; estos intentos solo reenvian UnprocessedItems
+_MAX_INTENTOS = 5
+_LOTE = 25  # limite de BatchWriteItem
+_MARGEN_S = 2  # tiempo reservado para devolver el 500 antes del timeout de Lambda
+_SER = TypeSerializer().serialize
+
+def _espera(i):
+    return min(1, 0.05*2**i) + random.uniform(0, 0.05)
+
+def _deadline(context):
+    if context is None: return None
+    return time.monotonic() + context.get_remaining_time_in_millis()/1000 - _MARGEN_S
+
+def _write_batch(client, reqs, deadline=None):
+    # Solo se lanza una llamada si, en el peor caso, termina antes del deadline
+    pendientes = {DDB_TABLE: reqs}
+    for i in range(_MAX_INTENTOS):
+        espera = _espera(i-1) if i else 0
+        if deadline is not None and time.monotonic() + espera + _DDB_LLAMADA_MAX_S > deadline: break
+        time.sleep(espera)
+        pendientes = client.batch_write_item(RequestItems=pendientes).get("UnprocessedItems") or {}
+        if not pendientes: return
+    raise RuntimeError(f"BatchWriteItem: {len(pendientes.get(DDB_TABLE, []))} items sin procesar")
+
+def upsert(items, deadline=None):
+    client = _client()
+    # BatchWriteItem rechaza claves repetidas en un mismo lote: gana la ultima (como overwrite_by_pkeys)
+    por_code = {it["code"]: it for it in items}
+    reqs = iter([{"PutRequest":{"Item":{k:_SER(v) for k,v in it.items()}}} for it in por_code.values()])
+    while lote := list(islice(reqs, _LOTE)):
+        _write_batch(client, lote, deadline)
+
+# Un solo hilo reutilizado entre invocaciones; el warmup se lanza una vez por sandbox
+_POOL = ThreadPoolExecutor(max_workers=1)
+_WARMUP = None
+
+def _warmup():
+    # Abre la conexion TLS a DynamoDB mientras se espera a ArcGIS; en invocaciones warm
+    # el pool keep-alive ya la tiene. Si falla (p.ej. sin dynamodb:DescribeTable) solo se registra
+    try: _client().describe_table(TableName=DDB_TABLE)
+    except Exception as e: print(f"warmup DynamoDB: {e}")
+
+def _warmup_once():
+    global _WARMUP
+    if _WARMUP is None: _WARMUP = _POOL.submit(_warmup)
+    return _WARMUP
 
 def lambda_ingestar(event, context):
+    warm, deadline = _warmup_once(), _deadline(context)
     try:
-        items = fetch_last_10(); upsert(items)
+        items = fetch_last_10()
+        if items: upsert(items, deadline)  # sin features no hay nada que escribir
         return {"statusCode":200,"headers":{"Content-Type":"application/json","Access-Control-Allow-Origin":"*"},
-                "body":json.dumps({"ingresados":len(items),"items":items}, default=str)}
+                "body":_dumps({"ingresados":len(items),"items":items}, default=str)}
     except Exception as e:
-        return {"statusCode":500,"body":json.dumps({"error":str(e)})}
+        return {"statusCode":500,"body":_dumps({"error":str(e)})}
+    finally:
+        # No dejar el warmup en vuelo al congelarse el sandbox (inmediato si ya termino);
+        # _DDB_LLAMADA_MAX_S cubre la llamada completa, el deadline el timeout de Lambda
+        wait([warm], timeout=_DDB_LLAMADA_MAX_S if deadline is None else
+             max(0, min(_DDB_LLAMADA_MAX_S, deadline - time.monotonic())))
+
+def _plain(av):
+    # Items de ingesta solo tienen S y N; N se deja como str (igual que Decimal con default=str)
+    return {k: v.get("S", v.get("N")) for k, v in av.items()}
 
 def lambda_listar(event, context):
     try:
-        ddb = boto3.resource("dynamodb").Table(DDB_TABLE)
-        resp = ddb.scan(Limit=50)
-        items = resp.get("Items", [])
-        items.sort(key=lambda x: x.get("fechaevento", x.get("ingresado_ts", 0)), reverse=True)
-        items = items[:10]
+        resp = _client().query(TableName=DDB_TABLE, IndexName=GSI_FECHA, KeyConditionExpression="#s = :s",
+                               ExpressionAttributeNames={"#s":"source"},
+                               ExpressionAttributeValues={":s":{"S":SOURCE}},
+                               ScanIndexForward=False, Limit=10)
+        items = [_plain(it) for it in resp.get("Items", [])]
         return {"statusCode":200,"headers":{"Content-Type":"application/json","Access-Control-Allow-Origin":"*"},
-                "body":json.dumps({"count":len(items),"items":items}, default=str)}
+                "body":_dumps({"count":len(items),"items":items})}
     except Exception as e:
-        return {"statusCode":500,"body":json.dumps({"error":str(e)})}
+        return {"statusCode":500,"body":_dumps({"error":str(e)})}